@@ -1,34 +1,1010 @@
 from fastapi import FastAPI, UploadFile, File, Query, Header
-from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse
-import tempfile, subprocess, os, shutil, uuid
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse, StreamingResponse, Response
+from contextlib import asynccontextmanager, contextmanager, ExitStack, AsyncExitStack
+from contextvars import ContextVar
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers, MutableHeaders
+from dataclasses import dataclass
+import asyncio, collections, math, tempfile, subprocess, os, shutil, uuid, json, time, hashlib, io, base64, zipfile, logging, threading
+import aiofiles, pikepdf
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily
+from pdfminer.high_level import extract_pages as pdfminer_pages
+from pdfminer.layout import LTTextContainer, LTImage, LTFigure
+import ocr_worker
+
+def available_cores() -> int:
+    """
+    CPUs this process may actually use: its affinity mask, capped by a
+    cgroup CPU quota when one is set (os.cpu_count() reports the host's
+    CPUs inside a container).
+    """
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:  # cgroup v2: "<quota> <period>" or "max <period>"
+            quota, period = f.read().split()[:2]
+    except OSError:
+        try:  # cgroup v1, -1 = no quota
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f, open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as g:
+                quota, period = f.read().strip(), g.read().strip()
+        except OSError:
+            quota = period = "max"
+    if quota not in ("max", "-1"):
+        cores = min(cores, math.ceil(int(quota) / int(period)))
+    return max(1, cores)
 
 APP_TOKEN = os.getenv("OCR_TOKEN", "changeme")
-app = FastAPI(title="Tiny OCR API (Fast MVP OCR)")
+# Concurrency: the CPU budget shared by all running OCR jobs (each job holds
+# at least one core), and how many more requests may wait for cores before
+# we start shedding load.
+OCR_CORES = int(os.getenv("OCR_CORES", str(available_cores())))
+OCR_QUEUE_SIZE = int(os.getenv("OCR_QUEUE_SIZE", str(OCR_CORES * 2)))
+OCR_RETRY_AFTER = int(os.getenv("OCR_RETRY_AFTER", "10"))  # seconds, sent with 503s
+# Cores no single job may take, so small documents arriving while a large one
+# runs still find one free (default: one core on machines with 4 or more).
+OCR_RESERVE_CORES = int(os.getenv("OCR_RESERVE_CORES", "1" if OCR_CORES >= 4 else "0"))
+# Per-process guardrails: Tesseract's OpenMP threads (1 avoids oversubscribing
+# cores we already parallelize across pages) and an address-space cap in MB
+# for each ocrmypdf process (0 = unlimited).
+OCR_OMP_THREAD_LIMIT = os.getenv("OCR_OMP_THREAD_LIMIT", "1")
+OCR_MAX_MEMORY_MB = int(os.getenv("OCR_MAX_MEMORY_MB", "0"))
+# Async jobs: pages per ocrmypdf invocation (smaller = earlier first page,
+# larger = less startup overhead) and how long finished jobs stay readable.
+OCR_JOB_CHUNK_PAGES = int(os.getenv("OCR_JOB_CHUNK_PAGES", "1"))
+OCR_JOB_TTL = int(os.getenv("OCR_JOB_TTL", "3600"))
+# Searchable PDFs of jobs live in a per-process directory under OCR_JOB_DIR,
+# removed on shutdown (and on startup, for processes that died without one).
+OCR_JOB_DIR = os.getenv("OCR_JOB_DIR", os.path.join(tempfile.gettempdir(), "ocr_jobs"))
+# Result cache: on-disk store keyed by content hash + OCR parameters.
+# OCR_CACHE_MAX_MB=0 turns it off; entries expire after OCR_CACHE_TTL seconds.
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ocr_cache"))
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", "512"))
+OCR_CACHE_TTL = int(os.getenv("OCR_CACHE_TTL", str(7 * 24 * 3600)))
+# Native-text fast path: in mode=auto a page's own text layer is used instead
+# of OCR when it has at least this many non-blank characters and no image
+# covers more than OCR_NATIVE_MAX_IMAGE_COVER of the page (i.e. not a scan).
+OCR_NATIVE_MIN_CHARS = int(os.getenv("OCR_NATIVE_MIN_CHARS", "16"))
+OCR_NATIVE_MAX_IMAGE_COVER = float(os.getenv("OCR_NATIVE_MAX_IMAGE_COVER", "0.5"))
+# ocrmypdf --output-type used when a searchable PDF is requested (output=pdf|both)
+# and one ocrmypdf run covers the whole output. PDFs merged from several runs
+# (chunked jobs, or native-text pages mixed in) are plain PDFs, not PDF/A.
+# Text-only requests always use "none" and skip PDF generation entirely.
+OCR_PDF_OUTPUT_TYPE = os.getenv("OCR_PDF_OUTPUT_TYPE", "pdfa")
+# Upload guardrails, checked while the upload is streamed to disk and before
+# any OCR work is queued (OCR_MAX_PAGES=0 means no page limit).
+OCR_MAX_UPLOAD_MB = int(os.getenv("OCR_MAX_UPLOAD_MB", "200"))
+OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", "1000"))
+# /ocr/batch: total request size (and uncompressed size of zipped PDFs) and
+# number of documents (zip members count)
+OCR_MAX_BATCH_MB = int(os.getenv("OCR_MAX_BATCH_MB", "500"))
+OCR_MAX_BATCH_FILES = int(os.getenv("OCR_MAX_BATCH_FILES", "1000"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# OCR engine: "cli" starts an ocrmypdf process per run; "worker" keeps
+# OCR_CORES warm processes with ocrmypdf already imported and dispatches runs
+# to them, recycling each worker after OCR_WORKER_MAX_JOBS runs.
+OCR_ENGINE = os.getenv("OCR_ENGINE", "cli")
+OCR_WORKER_MAX_JOBS = int(os.getenv("OCR_WORKER_MAX_JOBS", "50"))
+OCR_LOG_LEVEL = os.getenv("OCR_LOG_LEVEL", "INFO")
+
+# Structured logs: one JSON object per line, tagged with the request id
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        out = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+            "request_id": request_id.get(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out)
+
+log = logging.getLogger("tiny_ocr")
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(JsonFormatter())
+log.addHandler(_log_handler)
+log.setLevel(OCR_LOG_LEVEL)
+log.propagate = False
+
+# Prometheus metrics, served on /metrics
+REQUESTS = Counter("ocr_http_requests_total", "HTTP requests", ["route", "method", "status"])
+REQUEST_SECONDS = Histogram("ocr_http_request_seconds", "HTTP request latency", ["route"],
+                            buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+STAGE_SECONDS = Histogram("ocr_stage_seconds", "Time spent per pipeline stage", ["endpoint", "stage"],
+                          buckets=(0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+PAGES = Counter("ocr_pages_total", "Pages processed, by where their text came from", ["source"])
+
+class Timings:
+    """Wall time per pipeline stage for one request, in seconds."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t)
+
+    def finish(self, endpoint: str) -> dict:
+        """Record the total and feed the stage histograms; returns the timings in ms."""
+        self.stages["total"] = time.perf_counter() - self.started
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.labels(endpoint, stage).observe(seconds)
+        return self.ms()
+
+    def ms(self) -> dict:
+        return {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()}
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{stage};dur={ms}" for stage, ms in self.ms().items())
+
+workers: ProcessPoolExecutor | None = None
+workers_lock = asyncio.Lock()
+
+async def start_workers():
+    global workers
+    # At most OCR_CORES runs are in flight (each holds a core), so one worker per core suffices
+    executor = ProcessPoolExecutor(
+        OCR_CORES, initializer=ocr_worker.init,
+        initargs=(OCR_OMP_THREAD_LIMIT, OCR_MAX_MEMORY_MB),
+        max_tasks_per_child=OCR_WORKER_MAX_JOBS)
+    # Spawn and warm every worker now rather than on the first requests
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(executor, ocr_worker.ping) for _ in range(OCR_CORES)))
+    workers = executor
+
+async def restart_workers(broken: ProcessPoolExecutor):
+    """
+    Replace the worker pool after a worker died (OOM killer, RLIMIT_AS abort),
+    which leaves a ProcessPoolExecutor unusable. Every run that saw `broken`
+    fail calls this; only the first one actually restarts it.
+    """
+    async with workers_lock:
+        if workers is broken:
+            log.warning("ocr worker pool broken, restarting it")
+            broken.shutdown(wait=False, cancel_futures=True)
+            await start_workers()
+
+@asynccontextmanager
+async def lifespan(app):
+    if OCR_ENGINE == "worker":
+        await start_workers()
+    clear_job_dirs()
+    expiry = asyncio.create_task(expire_jobs_periodically())
+    yield
+    expiry.cancel()
+    if workers:
+        # Waits for running OCR to finish, so keep it off the event loop
+        await asyncio.to_thread(workers.shutdown, cancel_futures=True)
+    jobs.clear()
+    clear_job_dirs()
+
+app = FastAPI(title="Tiny OCR API (Fast MVP OCR)", lifespan=lifespan)
+
+class PoolSaturated(Exception):
+    """Raised when every core is busy and the wait queue is full."""
+
+class Grant:
+    """
+    Cores granted to one admitted job. Jobs that work through chunks (see
+    spread()) hand cores back between chunks while other jobs wait, so a
+    large document that found the machine idle doesn't keep every core for
+    its whole run, and take idle cores again once nobody is waiting.
+    """
+    def __init__(self, pool: "JobPool", cores: int):
+        self.pool = pool
+        self.cores = cores
+
+    async def give_back(self, n: int) -> bool:
+        """Return `n` cores to the pool if more jobs are waiting than there are free cores."""
+        if self.pool.waiting <= self.pool.free or n >= self.cores:
+            return False
+        self.cores -= n
+        await self.pool._release(n)
+        return True
+
+    def take(self, n: int) -> bool:
+        """Add `n` idle cores to the grant if no other job is waiting, within the pool's reserve."""
+        pool = self.pool
+        if pool.waiting or pool.free < n or self.cores + n > pool.cores - pool.reserve:
+            return False
+        pool.free -= n
+        self.cores += n
+        return True
+
+class JobPool:
+    """
+    Bounded admission control plus a shared core budget for OCR jobs. Up to
+    `cores` jobs run at once (each holds at least one core) and up to
+    `queue_size` more wait; anything beyond that is rejected immediately so
+    callers can back off instead of piling up. A job running alone may take
+    every core but `reserve`, while under load each job gets a fair share,
+    so one large document uses most of the machine and many small ones get
+    a core each.
+    """
+    def __init__(self, cores: int, queue_size: int, reserve: int = 0):
+        self.cores = max(1, cores)
+        self.queue_size = max(0, queue_size)
+        self.reserve = min(max(0, reserve), self.cores - 1)
+        self.pending = 0  # running + waiting
+        self.running = 0
+        self.free = self.cores
+        self._cond = asyncio.Condition()
+
+    @property
+    def full(self) -> bool:
+        return self.pending >= self.cores + self.queue_size
+
+    @property
+    def waiting(self) -> int:
+        return self.pending - self.running
+
+    def admit(self, want: int = 1) -> "Slot":
+        """
+        Reserve a place in line right now (raising PoolSaturated if there is
+        none) and return a Slot that waits for cores when entered. Splitting
+        the two lets background jobs be admitted before their task starts.
+        """
+        if self.full:
+            raise PoolSaturated()
+        self.pending += 1
+        return Slot(self, want)
+
+    async def _release(self, n: int):
+        async with self._cond:
+            self.free += n
+            self._cond.notify_all()
+
+class Slot:
+    """
+    A place in line from JobPool.admit(). `async with slot as grant` waits
+    for cores and yields a Grant of between 1 and `want` of them; `want` can
+    still be lowered until then, once the caller knows how much work is
+    left. A slot that turns out not to need cores is given back with
+    release() (entering and leaving it releases it too).
+    """
+    def __init__(self, pool: JobPool, want: int):
+        self.pool = pool
+        self.want = want
+        self.grant: Grant | None = None
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.pool.pending -= 1
+
+    async def __aenter__(self) -> Grant:
+        pool = self.pool
+        try:
+            async with pool._cond:
+                await pool._cond.wait_for(lambda: pool.free > 0)
+                share = max(1, min(pool.cores // pool.pending, pool.cores - pool.reserve))
+                self.grant = Grant(pool, min(max(1, self.want), pool.free, share))
+                pool.free -= self.grant.cores
+                pool.running += 1
+        except BaseException:
+            self.release()
+            raise
+        return self.grant
+
+    async def __aexit__(self, *exc):
+        pool = self.pool
+        try:
+            async with pool._cond:
+                pool.free += self.grant.cores
+                pool.running -= 1
+                pool._cond.notify_all()
+        finally:
+            self.release()
+
+async def spread(items: list, fn, runners: int, grant: Grant | None = None, cores_each: int = 1):
+    """
+    Await fn(item) for every item in order, `runners` at a time. Between
+    runs, a runner stops and hands its `cores_each` cores back to `grant`
+    while other jobs are waiting (one runner always carries on), and new
+    runners start on cores the grant can take back once they sit idle. If
+    any run fails the others are cancelled and the error propagates.
+    """
+    queue = collections.deque(items)
+    tasks: list[asyncio.Task] = []
+    live = 0
+
+    def start():
+        nonlocal live
+        live += 1
+        tasks.append(asyncio.create_task(runner()))
+
+    async def runner():
+        nonlocal live
+        while queue:
+            await fn(queue.popleft())
+            if not queue:
+                break
+            if grant and live > 1 and await grant.give_back(cores_each):
+                break
+            while grant and len(queue) > live and grant.take(cores_each):
+                start()
+        live -= 1
+
+    for _ in range(min(runners, len(items))):
+        start()
+    try:
+        # Runners may start more runners, so keep waiting until all are done
+        while not all(t.done() for t in tasks):
+            await asyncio.wait([t for t in tasks if not t.done()], return_when=asyncio.FIRST_EXCEPTION)
+            for t in tasks:
+                if t.done():
+                    t.result()
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        raise
+
+pool = JobPool(OCR_CORES, OCR_QUEUE_SIZE, OCR_RESERVE_CORES)
+
+Gauge("ocr_queue_depth", "Admitted OCR jobs waiting for cores").set_function(lambda: pool.waiting)
+Gauge("ocr_jobs_in_flight", "OCR jobs currently holding cores").set_function(lambda: pool.running)
+Gauge("ocr_cores_busy", "Cores currently granted to OCR jobs").set_function(lambda: pool.cores - pool.free)
+Gauge("ocr_cores", "Core budget shared by OCR jobs").set_function(lambda: pool.cores)
+
+class UploadRejected(Exception):
+    """Raised for uploads that are too large or not a usable PDF."""
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+class BatchTooLarge(UploadRejected):
+    """Raised when a batch as a whole goes over its document or size limits."""
+    def __init__(self, message: str):
+        super().__init__(message, 413)
+
+def error_response(e: Exception, status_code: int = 500):
+    """
+    Log the failure with its traceback and return the message, exception
+    type and request id, which the client can quote to find the log line.
+    Call from an except block.
+    """
+    log.exception("request failed", extra={"fields": {"error_type": type(e).__name__}})
+    return JSONResponse({
+        "ok": False,
+        "error": str(e) or type(e).__name__,
+        "error_type": type(e).__name__,
+        "request_id": request_id.get(),
+    }, status_code=status_code)
+
+def saturated_response():
+    return JSONResponse(
+        {"ok": False, "error": "server busy, retry later"},
+        status_code=503,
+        headers={"Retry-After": str(OCR_RETRY_AFTER)},
+    )
 
 @app.middleware("http")
 async def force_close_conn(request, call_next):
     """
-    Ensures that the 'Connection: close' header is present in responses.
-    This helps prevent client-side timeouts (like n8n's) for long-running
-    synchronous requests by signaling that the connection should be closed
-    after the response is fully sent.
+    Ensures that the 'Connection: close' header is present in responses
+    from the synchronous /ocr endpoint. This helps prevent client-side
+    timeouts (like n8n's) for long-running requests by signaling that the
+    connection should be closed after the response is fully sent. The
+    /jobs endpoints answer quickly, so they keep connections alive.
     """
     resp = await call_next(request)
     # Check if 'connection' header is already set (case-insensitive)
-    if "connection" not in {k.lower() for k in resp.headers.keys()}:
+    if request.url.path == "/ocr" and "connection" not in {k.lower() for k in resp.headers.keys()}:
         resp.headers["Connection"] = "close"
     return resp
 
+@app.middleware("http")
+async def limit_upload_size(request, call_next):
+    """
+    Reject uploads that announce a body larger than OCR_MAX_UPLOAD_MB
+    (OCR_MAX_BATCH_MB for batches) before the multipart parser spools them
+    anywhere. Chunked uploads without a Content-Length are still capped
+    per file while streaming in save_upload().
+    """
+    length = request.headers.get("content-length")
+    limit_mb = OCR_MAX_BATCH_MB if request.url.path == "/ocr/batch" else OCR_MAX_UPLOAD_MB
+    # Small allowance for the multipart envelope around the file itself
+    if request.method == "POST" and length and length.isdigit() \
+            and int(length) > limit_mb * 1024 * 1024 + 64 * 1024:
+        return JSONResponse({"ok": False, "error": f"upload exceeds {limit_mb} MB"}, status_code=413)
+    return await call_next(request)
+
+# Endpoints that queue OCR work, and so are shed while the pool is full
+OCR_ENDPOINTS = ("/ocr", "/ocr/batch", "/jobs")
+
+@app.middleware("http")
+async def shed_load(request, call_next):
+    """
+    Answer 503 to new OCR work while the pool is full, before FastAPI
+    parses and spools the multipart body for the endpoint.
+    """
+    if request.method == "POST" and request.url.path in OCR_ENDPOINTS and pool.full:
+        return saturated_response()
+    return await call_next(request)
+
+class ObserveRequests:
+    """
+    Tag the request with an id, then count, time and log it. A plain ASGI
+    middleware so the clock stops at the last body chunk: for the streaming
+    endpoints the headers go out long before the work is done.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rid = Headers(scope=scope).get("x-request-id") or uuid.uuid4().hex[:16]
+        token = request_id.set(rid)
+        t = time.perf_counter()
+        status, elapsed = 500, None
+
+        async def observed_send(message):
+            nonlocal status, elapsed
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append("X-Request-ID", rid)
+            elif message["type"] == "http.response.body" and not message.get("more_body"):
+                elapsed = time.perf_counter() - t
+            await send(message)
+
+        try:
+            await self.app(scope, receive, observed_send)
+        finally:
+            # Cut short when the client went away mid-stream
+            if elapsed is None:
+                elapsed = time.perf_counter() - t
+            # Label by route template so /jobs/{job_id} doesn't explode cardinality
+            route = getattr(scope.get("route"), "path", None)
+            if route is None:
+                # Rejected by a middleware before routing (413/503 on the OCR endpoints)
+                route = scope["path"] if scope["path"] in OCR_ENDPOINTS else "unmatched"
+            if route != "/metrics":
+                REQUESTS.labels(route, scope["method"], str(status)).inc()
+                REQUEST_SECONDS.labels(route).observe(elapsed)
+                log.info("request", extra={"fields": {
+                    "method": scope["method"], "route": route, "status": status,
+                    "duration_ms": round(elapsed * 1000, 1)}})
+            request_id.reset(token)
+
+# Added last so it wraps every other middleware
+app.add_middleware(ObserveRequests)
+
 @app.get("/")
 def root():
     return PlainTextResponse("ok")
 
-def run(cmd: str):
-    p = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE,
-                       stderr=subprocess.STDOUT, text=True)
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+async def run(cmd: list[str]):
+    # Async subprocess so the event loop (and health checks) stay responsive
+    # while ocrmypdf works. Arguments are passed as-is, no shell involved.
+    if OCR_MAX_MEMORY_MB > 0:
+        # prlimit applies the cap in the child; preexec_fn isn't safe with our worker threads
+        cmd = ["prlimit", f"--as={OCR_MAX_MEMORY_MB * 1024 * 1024}", "--", *cmd]
+    p = await asyncio.create_subprocess_exec(
+        *cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        env={**os.environ, "OMP_THREAD_LIMIT": OCR_OMP_THREAD_LIMIT})
+    try:
+        out, _ = await p.communicate()
+    except asyncio.CancelledError:
+        # Don't leave an orphaned ocrmypdf burning a core when a sibling chunk failed
+        p.kill()
+        await p.wait()
+        raise
+    out = out.decode("utf-8", errors="replace")
     if p.returncode != 0:
-        raise RuntimeError(p.stdout)
-    return p.stdout
+        raise RuntimeError(out)
+    return out
+
+@dataclass(frozen=True)
+class OcrParams:
+    lang: str = "eng"
+    tesseract_oem: int | None = 1
+    tesseract_psm: int | None = 6
+    mode: str = "auto"  # auto | force | skip_text, see native_text()
+
+    @property
+    def ocr_key(self) -> tuple:
+        """The fields that change what Tesseract outputs for a given page."""
+        return (self.lang, self.tesseract_oem, self.tesseract_psm)
+
+class ResultCache:
+    """
+    Content-addressed, on-disk store for OCR results. Each entry is a JSON
+    file (plus an optional PDF) named by its key. Reading an entry bumps its
+    mtime, so once the store grows past `max_bytes` the least recently used
+    entries are evicted first. Entries older than `ttl` seconds are misses.
+    Writes copy files and may walk the whole store, so async callers run
+    put() and size in a thread; a lock keeps those threads consistent.
+    """
+    def __init__(self, root: str, max_bytes: int, ttl: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "page_hits": 0, "page_misses": 0, "evictions": 0}
+        self._size: int | None = None  # bytes on disk, computed lazily
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            if self._size is None:
+                self._grow(0)
+            return self._size
+
+    @staticmethod
+    def key(*parts) -> str:
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(repr(part).encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.root, key[:2], key + ext)
+
+    def get(self, key: str, page: bool = False) -> dict | None:
+        if not self.enabled:
+            return None
+        path = self._path(key, ".json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if time.time() - entry["created"] > self.ttl:
+                with self._lock:
+                    self._remove(key)
+                entry = None
+            else:
+                os.utime(path)
+        except (OSError, ValueError, KeyError):
+            entry = None
+        self.stats[("page_" if page else "") + ("hits" if entry else "misses")] += 1
+        return entry
+
+    def copy_pdf(self, key: str, dest: str) -> bool:
+        """Copy the entry's PDF to `dest`; False if it has none."""
+        if not self.enabled:
+            return False
+        path = self._path(key, ".pdf")
+        # Under the lock so eviction can't remove it halfway through the copy
+        with self._lock:
+            try:
+                os.utime(path)
+                shutil.copyfile(path, dest)
+            except OSError:
+                return False
+        return True
+
+    def put(self, key: str, entry: dict, pdf_path: str | None = None):
+        if not self.enabled:
+            return
+        path = self._path(key, ".json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            self._remove(key)
+            if pdf_path:
+                shutil.copyfile(pdf_path, self._path(key, ".pdf"))
+                self._grow(os.path.getsize(pdf_path))
+            # Write-then-rename so concurrent readers never see a partial entry
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({**entry, "created": time.time()}, f)
+            self._grow(os.path.getsize(tmp))
+            os.replace(tmp, path)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st
+
+    def _grow(self, n: int):
+        if self._size is None:
+            self._size = sum(st.st_size for _, st in self._entries())
+        else:
+            self._size += n
+
+    def _remove(self, key: str):
+        for ext in (".json", ".pdf"):
+            path = self._path(key, ext)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+            self._grow(-size)
+
+    def _evict(self):
+        # Group files by entry key so an entry's JSON and PDF live and die together
+        entries: dict[str, list] = {}
+        for path, st in self._entries():
+            entries.setdefault(os.path.basename(path).split(".")[0], []).append((path, st))
+        self._size = sum(st.st_size for files in entries.values() for _, st in files)
+        # A PDF without its JSON can never be served, so it goes first; then
+        # least recently used entries until we are back under 90% of the budget
+        order = sorted(entries.values(), key=lambda files: (
+            any(p.endswith(".json") for p, _ in files), max(st.st_mtime for _, st in files)))
+        for files in order:
+            orphan = not any(p.endswith(".json") for p, _ in files)
+            if not orphan and self._size <= self.max_bytes * 0.9:
+                break
+            for path, st in files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self._size -= st.st_size
+            self.stats["evictions"] += 1
+
+cache = ResultCache(OCR_CACHE_DIR, OCR_CACHE_MAX_MB * 1024 * 1024, OCR_CACHE_TTL)
+
+class CacheCollector:
+    """Exposes the result cache's own counters as Prometheus counters."""
+    def collect(self):
+        events = CounterMetricFamily("ocr_cache_events", "Result cache events", labels=["event"])
+        for event, count in cache.stats.items():
+            events.add_metric([event], count)
+        yield events
+
+REGISTRY.register(CacheCollector())
+
+def parse_pages(spec: str | None, total: int) -> list[int]:
+    """
+    Turn an ocrmypdf-style page spec ("1-2", "1,3,5", "4-") into a sorted
+    list of 1-based page numbers that exist in the document.
+    """
+    if not spec:
+        return list(range(1, total + 1))
+    selected = set()
+    for part in spec.split(","):
+        part = part.strip()
+        try:
+            if "-" in part:
+                lo, hi = part.split("-", 1)
+                lo, hi = int(lo or 1), int(hi) if hi.strip() else total
+            else:
+                lo = hi = int(part)
+        except ValueError:
+            raise ValueError(f"invalid page range: {part!r}") from None
+        if lo < 1 or hi < lo:
+            raise ValueError(f"invalid page range: {part!r}")
+        selected.update(range(lo, min(hi, total) + 1))
+    if not selected:
+        raise ValueError(f"no pages selected by {spec!r} (document has {total})")
+    return sorted(selected)
+
+def page_count(path: str) -> int:
+    with pikepdf.open(path) as pdf:
+        return len(pdf.pages)
+
+def looks_like_pdf(head: bytes) -> bool:
+    # The spec allows a little junk before the header, so look in the first 1 KB
+    return b"%PDF-" in head[:1024]
+
+async def save_upload(file: UploadFile, dest: str, pdf: bool = True) -> str:
+    """
+    Stream an upload to `dest` in chunks, hashing it on the way, so the
+    whole document is never held in memory. Enforces OCR_MAX_UPLOAD_MB and,
+    if `pdf`, the PDF header. Returns the SHA-256 hex digest.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    limit = (OCR_MAX_UPLOAD_MB if pdf else OCR_MAX_BATCH_MB) * 1024 * 1024
+    async with aiofiles.open(dest, "wb") as f:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            if pdf and size == 0 and not looks_like_pdf(chunk):
+                raise UploadRejected("upload is not a PDF")
+            size += len(chunk)
+            if size > limit:
+                raise UploadRejected(f"upload exceeds {limit // (1024 * 1024)} MB", 413)
+            digest.update(chunk)
+            await f.write(chunk)
+    if size == 0:
+        raise UploadRejected("empty upload")
+    return digest.hexdigest()
+
+def validate_pdf(path: str) -> int:
+    """Check that `path` is a readable PDF within OCR_MAX_PAGES; returns its page count."""
+    with open(path, "rb") as f:
+        if not looks_like_pdf(f.read(1024)):
+            raise UploadRejected("upload is not a PDF")
+    try:
+        total = page_count(path)
+    except pikepdf.PdfError:
+        raise UploadRejected("upload is not a readable PDF")
+    if total == 0:
+        raise UploadRejected("PDF has no pages")
+    if OCR_MAX_PAGES and total > OCR_MAX_PAGES:
+        raise UploadRejected(f"PDF has {total} pages, limit is {OCR_MAX_PAGES}", 413)
+    return total
+
+async def receive_pdf(file: UploadFile, dest: str) -> tuple[str, int]:
+    """
+    Save an upload with save_upload() and validate it before any OCR is
+    queued. Returns the SHA-256 hex digest and the page count.
+    """
+    digest = await save_upload(file, dest)
+    return digest, await asyncio.to_thread(validate_pdf, dest)
+
+def extract_pages(src: str, pages: list[int], dest: str):
+    with pikepdf.open(src) as pdf, pikepdf.new() as out:
+        for n in pages:
+            out.pages.append(pdf.pages[n - 1])
+        out.save(dest)
+
+def page_digests(path: str, pages: list[int]) -> dict[int, str]:
+    """
+    SHA-256 of each page saved on its own with streams decoded, so the same
+    page content hashes the same regardless of which document it came from.
+    """
+    digests = {}
+    with pikepdf.open(path) as pdf:
+        for n in pages:
+            buf = io.BytesIO()
+            with pikepdf.new() as one:
+                one.pages.append(pdf.pages[n - 1])
+                one.save(buf, deterministic_id=True, compress_streams=False,
+                         stream_decode_level=pikepdf.StreamDecodeLevel.generalized)
+            digests[n] = hashlib.sha256(buf.getvalue()).hexdigest()
+    return digests
+
+def _images(layout):
+    for obj in layout:
+        if isinstance(obj, LTImage):
+            yield obj
+        elif isinstance(obj, LTFigure):
+            yield from _images(obj)
+
+def native_text(path: str, pages: list[int], mode: str) -> dict[int, str]:
+    """
+    Extract the existing text layer of pages that can skip OCR. In
+    "skip_text" mode any page with text qualifies (like ocrmypdf's
+    --skip-text); "auto" also requires OCR_NATIVE_MIN_CHARS characters and
+    no page-sized image, so scans with a junk text layer still get OCR'd.
+    """
+    if mode == "force" or not pages:
+        return {}
+    found = {}
+    try:
+        for n, layout in zip(pages, pdfminer_pages(path, page_numbers=[n - 1 for n in pages])):
+            text = "".join(obj.get_text() for obj in layout if isinstance(obj, LTTextContainer))
+            chars = len("".join(text.split()))
+            if mode == "skip_text":
+                native = chars > 0
+            else:
+                page_area = (layout.width * layout.height) or 1
+                cover = max((img.width * img.height / page_area for img in _images(layout)), default=0)
+                native = chars >= OCR_NATIVE_MIN_CHARS and cover <= OCR_NATIVE_MAX_IMAGE_COVER
+            if native:
+                found[n] = text
+    except Exception:
+        # pdfminer can choke on PDFs ocrmypdf copes with; just OCR everything
+        return {}
+    return found
+
+def assemble_pdf(in_pdf: str, pages: list[int], chunk_pdfs: list[tuple[list[int], str]], dest: str):
+    """
+    Write `pages` to `dest` in order, taking each page from the OCR'd chunk
+    that covered it or, for native-text pages, from the original document.
+    """
+    if len(chunk_pdfs) == 1 and chunk_pdfs[0][0] == pages:
+        # One chunk covering everything: keep ocrmypdf's output (and its PDF/A metadata) as-is
+        shutil.copyfile(chunk_pdfs[0][1], dest)
+        return
+    with ExitStack() as stack:
+        src = stack.enter_context(pikepdf.open(in_pdf))
+        origin = {n: src.pages[n - 1] for n in pages}
+        for chunk, path in chunk_pdfs:
+            origin.update(zip(chunk, stack.enter_context(pikepdf.open(path)).pages))
+        out = stack.enter_context(pikepdf.new())
+        for n in pages:
+            out.pages.append(origin[n])
+        out.save(dest)
+
+def cli_args(options: dict) -> list[str]:
+    """Render ocrmypdf API-style keyword options as command line flags."""
+    args = []
+    for name, value in options.items():
+        flag = "--" + name.replace("_", "-")
+        args += [flag] if value is True else [flag, str(value)]
+    return args
+
+async def run_in_worker(src: str, out_pdf: str, options: dict):
+    """
+    Run ocrmypdf in a warm worker. If the pool broke because a worker died,
+    restart it and retry the run once.
+    """
+    for attempt in range(2):
+        executor = workers
+        try:
+            fut = asyncio.get_running_loop().run_in_executor(executor, ocr_worker.ocr, src, out_pdf, options)
+        except BrokenProcessPool:
+            await restart_workers(executor)
+            continue
+        try:
+            return await asyncio.shield(fut)
+        except BrokenProcessPool:
+            await restart_workers(executor)
+            if attempt:
+                raise
+        except asyncio.CancelledError:
+            # A worker can't be interrupted mid-run, so keep holding its cores
+            # until it is actually free again rather than overcommit the pool
+            await asyncio.wait([fut])
+            if not fut.cancelled():
+                fut.exception()  # retrieved, so asyncio doesn't log it as unhandled
+            raise
+    raise BrokenProcessPool("OCR worker pool is not usable")
+
+async def ocr_chunk(in_pdf: str, pages: list[int], total: int, work: str, params: OcrParams,
+                    pdf_type: str | None = None, jobs: int = 1) -> tuple[list[str], str | None]:
+    """
+    OCR the given pages of `in_pdf` in one ocrmypdf run using `jobs` cores.
+    Returns one text per page and, if `pdf_type` is set, the path of the
+    searchable PDF for the chunk, built with that ocrmypdf --output-type.
+    """
+    tag = f"{pages[0]}-{pages[-1]}"
+    src = in_pdf
+    if len(pages) != total:
+        src = os.path.join(work, f"chunk_{tag}.pdf")
+        await asyncio.to_thread(extract_pages, in_pdf, pages, src)
+    # Text-only runs skip PDF rendering and PDF/A conversion altogether
+    out_pdf = os.path.join(work, f"out_{tag}.pdf") if pdf_type else os.devnull
+    sidecar = os.path.join(work, f"text_{tag}.txt")
+
+    options = {
+        "force_ocr": True,
+        "optimize": 0,                  # no extra compression work (fastest)
+        "language": params.lang,
+        "jobs": jobs,                   # cores granted by the scheduler
+        "tesseract_timeout": 120,       # guardrail for pathological inputs
+        "sidecar": sidecar,
+        "output_type": pdf_type or "none",
+    }
+
+    # Pass through safe Tesseract speed knobs when explicitly provided
+    if params.tesseract_oem is not None:
+        options["tesseract_oem"] = params.tesseract_oem
+    if params.tesseract_psm is not None:
+        options["tesseract_pagesegmode"] = params.tesseract_psm
+
+    if workers:
+        options["language"] = params.lang.split("+")
+        await run_in_worker(src, out_pdf, options)
+    else:
+        await run(["ocrmypdf", *cli_args(options), src, out_pdf])
+
+    text = ""
+    if os.path.exists(sidecar):
+        with open(sidecar, "r", encoding="utf-8", errors="ignore") as s:
+            text = s.read()
+    # ocrmypdf separates pages in the sidecar with a form feed
+    texts = text.split("\f")
+    texts += [""] * (len(pages) - len(texts))
+    return texts[:len(pages)], out_pdf if pdf_type else None
+
+async def ocr_document(in_pdf: str, work: str, pages: list[int], total: int,
+                       params: OcrParams, chunk_pages: int, on_page=None,
+                       out_pdf: str | None = None, slot: Slot | None = None,
+                       timings: Timings | None = None) -> tuple[list[str], dict]:
+    """
+    OCR `pages` in chunks of `chunk_pages` with spread(), calling
+    on_page(page_no, text) in page order as results become available. Pages
+    with a usable text layer (see native_text) or already in the page cache
+    are not OCR'd. The rest wait for cores from `slot`, sized to what is
+    actually left to OCR (the slot is released unused if nothing is);
+    without a slot they run on the one core the caller already holds. If
+    `out_pdf` is given, the searchable PDF is assembled there as well.
+    Returns the page texts in page order and counts of native/cached pages;
+    stage durations are added to `timings`.
+    """
+    try:
+        return await _ocr_document(in_pdf, work, pages, total, params, chunk_pages,
+                                   on_page, out_pdf, slot, timings or Timings())
+    finally:
+        if slot:
+            slot.release()
+
+async def _ocr_document(in_pdf, work, pages, total, params, chunk_pages, on_page, out_pdf, slot, timings):
+    with timings.stage("native"):
+        done = await asyncio.to_thread(native_text, in_pdf, pages, params.mode)
+    stats = {"native": len(done), "cached": 0}
+    keys: dict[int, str] = {}
+    # The page cache holds text only, so PDF output has to OCR every page
+    if cache.enabled and out_pdf is None:
+        with timings.stage("page_cache"):
+            rest = [n for n in pages if n not in done]
+            digests = await asyncio.to_thread(page_digests, in_pdf, rest)
+            for n in rest:
+                keys[n] = cache.key(digests[n], params.ocr_key)
+                entry = cache.get(keys[n], page=True)
+                if entry:
+                    done[n] = entry["text"]
+                    stats["cached"] += 1
+
+    emitted = 0
+    def emit():
+        nonlocal emitted
+        while emitted < len(pages) and pages[emitted] in done:
+            if on_page:
+                on_page(pages[emitted], done[pages[emitted]])
+            emitted += 1
+
+    emit()
+    todo = [n for n in pages if n not in done]
+    chunk_pages = max(1, chunk_pages)
+    chunks = [todo[i:i + chunk_pages] for i in range(0, len(todo), chunk_pages)]
+    chunk_pdfs = []
+    # assemble_pdf() only keeps ocrmypdf's output as-is (PDF/A metadata and
+    # all) when one chunk covers every page; merged chunks lose it, so they
+    # skip the PDF/A conversion and are built as plain PDFs
+    pdf_type = None
+    if out_pdf:
+        pdf_type = OCR_PDF_OUTPUT_TYPE if chunks == [pages] else "pdf"
+
+    async def do_chunk(chunk: list[int]):
+        texts, chunk_pdf = await ocr_chunk(in_pdf, chunk, total, work, params,
+                                           pdf_type=pdf_type, jobs=cores // parallel)
+        if chunk_pdf:
+            chunk_pdfs.append((chunk, chunk_pdf))
+        for n, text in zip(chunk, texts):
+            done[n] = text
+            if n in keys:
+                await asyncio.to_thread(cache.put, keys[n], {"text": text})
+        emit()
+
+    grant = None
+    async with AsyncExitStack() as stack:
+        if slot and todo:
+            slot.want = len(todo)
+            with timings.stage("queue"):
+                grant = await stack.enter_async_context(slot)
+        # Fewer chunks than cores: run them all at once and let ocrmypdf spread
+        # each over the spare cores. Otherwise keep `cores` single-core chunks busy.
+        cores = grant.cores if grant else 1
+        parallel = min(cores, len(chunks)) or 1
+        # Rasterizing and Tesseract both happen inside ocrmypdf, so they share one stage
+        with timings.stage("ocr"):
+            await spread(chunks, do_chunk, parallel, grant, cores // parallel)
+    if out_pdf:
+        with timings.stage("assemble"):
+            await asyncio.to_thread(assemble_pdf, in_pdf, pages, chunk_pdfs, out_pdf)
+    PAGES.labels("native").inc(stats["native"])
+    PAGES.labels("cache").inc(stats["cached"])
+    PAGES.labels("ocr").inc(len(todo))
+    return [done[n] for n in pages], stats
+
+def cache_headers(status: str, cached_pages: int = 0, total_pages: int = 0) -> dict:
+    headers = {"X-Cache": status}
+    if status != "HIT" and total_pages:
+        headers["X-Cache-Pages"] = f"{cached_pages}/{total_pages}"
+    return headers
 
 @app.post("/ocr")
 async def ocr_pdf(
@@ -37,56 +1013,459 @@ async def ocr_pdf(
     pages: str | None = Query(None, description="e.g. 1-2 or 1,3,5"),
     tesseract_oem: int | None = Query(1, ge=0, le=3, description="Tesseract OCR Engine Mode (0-3). 1=LSTM-only is usually fast + accurate."),
     tesseract_psm: int | None = Query(6, ge=0, le=13, description="Tesseract Page Segmentation Mode (0-13). 6 often speeds up uniform pages."),
+    mode: str = Query("auto", pattern="^(auto|force|skip_text)$", description="auto/skip_text reuse pages' existing text layer; force OCRs every page."),
+    output: str = Query("text", pattern="^(text|pdf|both)$", description="text (fastest, no PDF is built), pdf (searchable PDF file) or both (JSON with base64 'pdf')."),
     x_app_token: str | None = Header(None, alias="x-app-token")
 ):
     if x_app_token != APP_TOKEN:
         return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
 
+    timings = Timings()
     work = tempfile.mkdtemp(prefix="ocr_")
+    cleanup = True
     try:
-        in_pdf  = os.path.join(work, "in.pdf")
-        out_pdf = os.path.join(work, "out.pdf")
-        sidecar = os.path.join(work, "text.txt")
-
-        with open(in_pdf, "wb") as f:
-            f.write(await file.read())
-
-        cmd = [
-            "ocrmypdf",
-            "--force-ocr",
-            "--optimize", "0",              # no extra compression work (fastest)
-            "--language", lang,
-            "--jobs", "1",                  # keep serial for predictable resource usage
-            "--tesseract-timeout", "120",   # guardrail for pathological inputs
-            "--sidecar", sidecar
-        ]
-
-        # Pass through safe Tesseract speed knobs when explicitly provided
-        if tesseract_oem is not None:
-            cmd += ["--tesseract-oem", str(tesseract_oem)]
-        if tesseract_psm is not None:
-            cmd += ["--tesseract-pagesegmode", str(tesseract_psm)]
-        if pages:
-            cmd += ["--pages", pages]
-        cmd += [in_pdf, out_pdf]
-
-        # Execute ocrmypdf
-        run(" ".join(cmd))
-
-        text = ""
-        if os.path.exists(sidecar):
-            with open(sidecar, "r", encoding="utf-8", errors="ignore") as s:
-                text = s.read()
-                
-        return JSONResponse({
+        in_pdf = os.path.join(work, "in.pdf")
+        with timings.stage("upload"):
+            digest, total = await receive_pdf(file, in_pdf)
+        try:
+            selected = parse_pages(pages, total)
+        except ValueError as e:
+            return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+
+        params = OcrParams(lang, tesseract_oem, tesseract_psm, mode)
+        out_pdf = os.path.join(work, "out.pdf") if output != "text" else None
+        doc_key = cache.key(digest, selected, params)
+        with timings.stage("cache"):
+            entry = cache.get(doc_key)
+            # A text-only entry can't serve a PDF request
+            hit = entry and (not out_pdf or await asyncio.to_thread(cache.copy_pdf, doc_key, out_pdf))
+        if hit:
+            texts, native, headers = entry["pages"], entry.get("native", 0), cache_headers("HIT")
+        else:
+            # Execute ocrmypdf once cores are free; the pages that need OCR go
+            # through a single invocation to pay startup cost only once.
+            texts, stats = await ocr_document(in_pdf, work, selected, total, params, len(selected),
+                                              out_pdf=out_pdf, slot=pool.admit(), timings=timings)
+            native = stats["native"]
+            await asyncio.to_thread(cache.put, doc_key, {"pages": texts, "native": native}, pdf_path=out_pdf)
+            headers = cache_headers("PARTIAL" if stats["cached"] else "MISS", stats["cached"], len(selected))
+
+        timings_ms = timings.finish("ocr")
+        headers["Server-Timing"] = timings.server_timing()
+        log.info("ocr done", extra={"fields": {
+            "pages": len(selected), "native_pages": native, "cache": headers["X-Cache"],
+            "mode": mode, "output": output, "timings_ms": timings_ms}})
+
+        if output == "pdf":
+            # The response streams from `work`, so clean it up afterwards instead
+            cleanup = False
+            name = os.path.splitext(os.path.basename(file.filename or "document"))[0]
+            return FileResponse(out_pdf, media_type="application/pdf", filename=f"{name}_ocr.pdf",
+                                headers=headers, background=BackgroundTask(shutil.rmtree, work, ignore_errors=True))
+
+        body = {
             "ok": True,
             "pages": pages or "all",
             "lang": lang,
-            "text": text
-        })
+            "mode": mode,
+            "native_pages": native,
+            "timings_ms": timings_ms,
+            "text": "\f".join(texts)
+        }
+        if output == "both":
+            with open(out_pdf, "rb") as f:
+                body["pdf"] = base64.b64encode(f.read()).decode("ascii")
+        return JSONResponse(body, headers=headers)
+    except PoolSaturated:
+        return saturated_response()
+    except UploadRejected as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=e.status_code)
     except Exception as e:
         # Catch all exceptions during processing and return a 500
-        return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
+        return error_response(e)
     finally:
         # Ensure temporary working directory is cleaned up
-        shutil.rmtree(work, ignore_errors=True)
\ No newline at end of file
+        if cleanup:
+            shutil.rmtree(work, ignore_errors=True)
+
+def unpack_zip(path: str, dest_dir: str, label: str, max_docs: int, max_bytes: int) -> list[dict]:
+    """
+    Extract the PDFs inside a zip upload into `dest_dir`, hashing each one.
+    Returns a batch entry per PDF: {"filename", "path", "digest"}, or
+    {"filename", "error"} for members over OCR_MAX_UPLOAD_MB. Raises
+    BatchTooLarge before extracting anything if the archive holds
+    more than `max_docs` PDFs or more than `max_bytes` of them uncompressed.
+    """
+    docs = []
+    limit = OCR_MAX_UPLOAD_MB * 1024 * 1024
+    with zipfile.ZipFile(path) as zf:
+        members = [m for m in zf.infolist() if not m.is_dir() and m.filename.lower().endswith(".pdf")]
+        if len(members) > max_docs:
+            raise BatchTooLarge(f"batch has more than {OCR_MAX_BATCH_FILES} documents")
+        # zipfile stops reading a member at its declared size, so this sum bounds what we write
+        if sum(m.file_size for m in members if m.file_size <= limit) > max_bytes:
+            raise BatchTooLarge(f"batch exceeds {OCR_MAX_BATCH_MB} MB uncompressed")
+        for i, member in enumerate(members):
+            doc = {"filename": f"{label}/{member.filename}"}
+            if member.file_size > limit:
+                doc["error"] = f"upload exceeds {OCR_MAX_UPLOAD_MB} MB"
+            else:
+                doc["path"] = os.path.join(dest_dir, f"{os.path.basename(path)}_{i}.pdf")
+                digest = hashlib.sha256()
+                with zf.open(member) as src, open(doc["path"], "wb") as out:
+                    while chunk := src.read(UPLOAD_CHUNK_SIZE):
+                        digest.update(chunk)
+                        out.write(chunk)
+                doc["digest"] = digest.hexdigest()
+                doc["size"] = member.file_size
+            docs.append(doc)
+    return docs
+
+async def ocr_batch_doc(doc: dict, work: str, params: OcrParams) -> dict:
+    """OCR one document of a batch on a single core; errors become part of the result."""
+    result = {"index": doc["index"], "filename": doc["filename"]}
+    if "error" in doc:
+        return {**result, "ok": False, "error": doc["error"]}
+    timings = Timings()
+    try:
+        total = await asyncio.to_thread(validate_pdf, doc["path"])
+        selected = list(range(1, total + 1))
+        # Same key as a whole-document /ocr request, so the two share cache entries
+        doc_key = cache.key(doc["digest"], selected, params)
+        with timings.stage("cache"):
+            entry = cache.get(doc_key)
+        if entry:
+            texts, native, status = entry["pages"], entry.get("native", 0), "HIT"
+        else:
+            doc_work = os.path.join(work, f"doc_{doc['index']}")
+            os.makedirs(doc_work)
+            texts, stats = await ocr_document(doc["path"], doc_work, selected, total, params, total,
+                                              timings=timings)
+            native, status = stats["native"], "PARTIAL" if stats["cached"] else "MISS"
+            await asyncio.to_thread(cache.put, doc_key, {"pages": texts, "native": native})
+        return {**result, "ok": True, "pages": total, "native_pages": native, "cache": status,
+                "timings_ms": timings.finish("batch"), "text": "\f".join(texts)}
+    except Exception as e:
+        log.warning("batch document failed", exc_info=True, extra={"fields": {"filename": doc["filename"]}})
+        return {**result, "ok": False, "error": str(e) or type(e).__name__, "error_type": type(e).__name__}
+
+@app.post("/ocr/batch")
+async def ocr_batch(
+    files: list[UploadFile] = File(..., description="PDFs and/or zip archives of PDFs"),
+    lang: str = Query("eng", description="tesseract language(s), e.g. eng or eng+spa"),
+    tesseract_oem: int | None = Query(1, ge=0, le=3, description="Tesseract OCR Engine Mode (0-3)."),
+    tesseract_psm: int | None = Query(6, ge=0, le=13, description="Tesseract Page Segmentation Mode (0-13)."),
+    mode: str = Query("auto", pattern="^(auto|force|skip_text)$", description="auto/skip_text reuse pages' existing text layer; force OCRs every page."),
+    x_app_token: str | None = Header(None, alias="x-app-token")
+):
+    """
+    OCR many small documents in one request. Results stream back as NDJSON,
+    one {"index", "filename", "ok", "text", ...} line per document in
+    completion order, followed by a final {"done", "files", "failed"} line.
+    """
+    if x_app_token != APP_TOKEN:
+        return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+
+    work = tempfile.mkdtemp(prefix="ocrbatch_")
+    try:
+        docs = []
+        # Documents and bytes on disk, checked before each upload is saved or unpacked
+        # so a zip bomb is refused before it is extracted
+        budget = OCR_MAX_BATCH_MB * 1024 * 1024
+        for i, file in enumerate(files):
+            name = file.filename or f"file_{i}"
+            path = os.path.join(work, f"upload_{i}")
+            is_zip = name.lower().endswith(".zip") or file.content_type in ("application/zip", "application/x-zip-compressed")
+            used = sum(doc.get("size", 0) for doc in docs)
+            if len(docs) >= OCR_MAX_BATCH_FILES:
+                raise BatchTooLarge(f"batch has more than {OCR_MAX_BATCH_FILES} documents")
+            try:
+                digest = await save_upload(file, path, pdf=not is_zip)
+                if is_zip:
+                    docs += await asyncio.to_thread(unpack_zip, path, work, name,
+                                                    OCR_MAX_BATCH_FILES - len(docs), budget - used)
+                    os.remove(path)
+                else:
+                    docs.append({"filename": name, "path": path, "digest": digest, "size": os.path.getsize(path)})
+            except BatchTooLarge:
+                raise
+            except UploadRejected as e:
+                docs.append({"filename": name, "error": str(e)})
+            except zipfile.BadZipFile:
+                docs.append({"filename": name, "error": "upload is not a readable zip"})
+        # The batch takes one place in line and runs as many documents at once as it is granted cores
+        slot = pool.admit(want=len(docs))
+    except PoolSaturated:
+        shutil.rmtree(work, ignore_errors=True)
+        return saturated_response()
+    except BatchTooLarge as e:
+        shutil.rmtree(work, ignore_errors=True)
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=e.status_code)
+    except Exception as e:
+        shutil.rmtree(work, ignore_errors=True)
+        return error_response(e)
+
+    params = OcrParams(lang, tesseract_oem, tesseract_psm, mode)
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def run_batch():
+        # Runs as its own task so slot accounting and cleanup happen even
+        # if the client never reads the stream.
+        queued = time.perf_counter()
+        try:
+            async with slot as grant:
+                STAGE_SECONDS.labels("batch", "queue").observe(time.perf_counter() - queued)
+
+                async def run_one(doc: dict):
+                    results.put_nowait(await ocr_batch_doc(doc, work, params))
+
+                await spread([{**doc, "index": i} for i, doc in enumerate(docs)], run_one, grant.cores, grant)
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+    task = asyncio.create_task(run_batch())
+
+    async def lines():
+        failed = 0
+        try:
+            for _ in docs:
+                result = await results.get()
+                failed += not result["ok"]
+                yield json.dumps(result) + "\n"
+            yield json.dumps({"done": True, "files": len(docs), "failed": failed}) + "\n"
+        finally:
+            # No-op once the batch is finished; stops the work if the client went away
+            task.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+class Job:
+    """State of one background OCR job, readable while it runs."""
+    def __init__(self, pages_total: int, lang: str, output: str = "text"):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"  # queued -> running -> done | error
+        self.lang = lang
+        self.output = output
+        self.pages_total = pages_total
+        # Searchable PDF lives outside the job's work dir so it outlasts the run
+        self.pdf_path = os.path.join(job_pdf_dir(), f"{self.id}.pdf") if output != "text" else None
+        self.pages: list[tuple[int, str]] = []  # (page number, text) in page order
+        self.error: str | None = None
+        self.finished_at: float | None = None
+        self.timings = Timings()
+        self.task: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+
+    def update(self, status: str | None = None, page: tuple[int, str] | None = None):
+        if status:
+            self.status = status
+            if status in ("done", "error"):
+                self.finished_at = time.time()
+        if page:
+            self.pages.append(page)
+        # Wake every follower, then arm a fresh event for the next change
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self):
+        """Yield (page, text) as pages complete, until the job finishes."""
+        i = 0
+        while True:
+            while i < len(self.pages):
+                yield self.pages[i]
+                i += 1
+            if self.status in ("done", "error"):
+                return
+            await self._changed.wait()
+
+    def summary(self) -> dict:
+        out = {
+            "ok": self.status != "error",
+            "id": self.id,
+            "status": self.status,
+            "lang": self.lang,
+            "output": self.output,
+            "pages_done": len(self.pages),
+            "pages_total": self.pages_total,
+        }
+        if self.error:
+            out["error"] = self.error
+        if self.status == "done":
+            out["timings_ms"] = self.timings.ms()
+            out["text"] = "\f".join(text for _, text in self.pages)
+        return out
+
+jobs: dict[str, Job] = {}
+
+def job_pdf_dir() -> str:
+    path = os.path.join(OCR_JOB_DIR, str(os.getpid()))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def clear_job_dirs():
+    """Remove this process's job PDFs and those left behind by processes that are gone."""
+    try:
+        names = os.listdir(OCR_JOB_DIR)
+    except OSError:
+        return
+    for name in names:
+        if not name.isdigit():
+            continue
+        if int(name) != os.getpid():
+            try:
+                os.kill(int(name), 0)
+                continue  # another live worker process owns it
+            except ProcessLookupError:
+                pass
+            except PermissionError:
+                continue
+        shutil.rmtree(os.path.join(OCR_JOB_DIR, name), ignore_errors=True)
+
+def expire_jobs():
+    now = time.time()
+    for job_id in [j.id for j in jobs.values() if j.finished_at and now - j.finished_at > OCR_JOB_TTL]:
+        job = jobs.pop(job_id)
+        if job.pdf_path and os.path.exists(job.pdf_path):
+            os.remove(job.pdf_path)
+
+async def expire_jobs_periodically():
+    # Finished jobs also expire when nobody posts or polls jobs for a while
+    while True:
+        await asyncio.sleep(min(OCR_JOB_TTL, 60))
+        expire_jobs()
+
+async def run_job(job: Job, slot, work: str, in_pdf: str, pages: list[int], total: int,
+                  params: OcrParams, doc_key: str):
+    try:
+        job.update("running")
+        texts, stats = await ocr_document(in_pdf, work, pages, total, params, OCR_JOB_CHUNK_PAGES,
+                                          on_page=lambda n, text: job.update(page=(n, text)),
+                                          out_pdf=job.pdf_path, slot=slot, timings=job.timings)
+        await asyncio.to_thread(cache.put, doc_key, {"pages": texts, "native": stats["native"]}, pdf_path=job.pdf_path)
+        timings_ms = job.timings.finish("jobs")
+        job.update("done")
+        log.info("job done", extra={"fields": {
+            "job_id": job.id, "pages": len(pages), "native_pages": stats["native"], "timings_ms": timings_ms}})
+    except Exception as e:
+        log.exception("job failed", extra={"fields": {"job_id": job.id}})
+        job.error = str(e) or type(e).__name__
+        job.update("error")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+def job_or_404(job_id: str, x_app_token: str | None):
+    if x_app_token != APP_TOKEN:
+        return None, JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+    expire_jobs()
+    job = jobs.get(job_id)
+    if job is None:
+        return None, JSONResponse({"ok": False, "error": "job not found"}, status_code=404)
+    return job, None
+
+@app.post("/jobs")
+async def create_job(
+    file: UploadFile = File(...),
+    lang: str = Query("eng", description="tesseract language(s), e.g. eng or eng+spa"),
+    pages: str | None = Query(None, description="e.g. 1-2 or 1,3,5"),
+    tesseract_oem: int | None = Query(1, ge=0, le=3, description="Tesseract OCR Engine Mode (0-3)."),
+    tesseract_psm: int | None = Query(6, ge=0, le=13, description="Tesseract Page Segmentation Mode (0-13)."),
+    mode: str = Query("auto", pattern="^(auto|force|skip_text)$", description="auto/skip_text reuse pages' existing text layer; force OCRs every page."),
+    output: str = Query("text", pattern="^(text|pdf|both)$", description="pdf/both also build a searchable PDF, served by GET /jobs/{id}/pdf."),
+    x_app_token: str | None = Header(None, alias="x-app-token")
+):
+    if x_app_token != APP_TOKEN:
+        return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+    expire_jobs()
+
+    timings = Timings()
+    work = tempfile.mkdtemp(prefix="ocrjob_")
+    try:
+        in_pdf = os.path.join(work, "in.pdf")
+        with timings.stage("upload"):
+            digest, total = await receive_pdf(file, in_pdf)
+        try:
+            selected = parse_pages(pages, total)
+        except ValueError as e:
+            shutil.rmtree(work, ignore_errors=True)
+            return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+
+        params = OcrParams(lang, tesseract_oem, tesseract_psm, mode)
+        doc_key = cache.key(digest, selected, params)
+        job = Job(len(selected), lang, output)
+        job.timings = timings
+        with timings.stage("cache"):
+            entry = cache.get(doc_key)
+            hit = entry and (output == "text" or await asyncio.to_thread(cache.copy_pdf, doc_key, job.pdf_path))
+        if hit:
+            # Already recognized: the job is born finished
+            shutil.rmtree(work, ignore_errors=True)
+            for page in zip(selected, entry["pages"]):
+                job.update(page=page)
+            timings.finish("jobs")
+            job.update("done")
+            jobs[job.id] = job
+            return JSONResponse(job.summary(), status_code=202, headers=cache_headers("HIT"))
+
+        slot = pool.admit()
+    except PoolSaturated:
+        shutil.rmtree(work, ignore_errors=True)
+        return saturated_response()
+    except UploadRejected as e:
+        shutil.rmtree(work, ignore_errors=True)
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=e.status_code)
+    except Exception as e:
+        shutil.rmtree(work, ignore_errors=True)
+        return error_response(e)
+
+    # The job task owns `work` from here on and removes it when done
+    jobs[job.id] = job
+    job.task = asyncio.create_task(run_job(job, slot, work, in_pdf, selected, total, params, doc_key))
+    return JSONResponse(job.summary(), status_code=202, headers=cache_headers("MISS"))
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, x_app_token: str | None = Header(None, alias="x-app-token")):
+    job, err = job_or_404(job_id, x_app_token)
+    return err or JSONResponse(job.summary())
+
+@app.get("/jobs/{job_id}/pdf")
+async def get_job_pdf(job_id: str, x_app_token: str | None = Header(None, alias="x-app-token")):
+    job, err = job_or_404(job_id, x_app_token)
+    if err:
+        return err
+    if not job.pdf_path:
+        return JSONResponse({"ok": False, "error": "job was submitted with output=text"}, status_code=404)
+    if job.status != "done":
+        return JSONResponse({"ok": False, "error": f"job is {job.status}"}, status_code=409)
+    return FileResponse(job.pdf_path, media_type="application/pdf", filename=f"{job.id}.pdf")
+
+@app.get("/jobs/{job_id}/text")
+async def stream_job_text(job_id: str, x_app_token: str | None = Header(None, alias="x-app-token")):
+    """
+    Stream page texts as NDJSON, one {"page", "text"} line per page as soon
+    as it is recognized, followed by a final {"status"} line.
+    """
+    job, err = job_or_404(job_id, x_app_token)
+    if err:
+        return err
+
+    async def lines():
+        async for n, text in job.follow():
+            yield json.dumps({"page": n, "text": text}) + "\n"
+        final = {"status": job.status}
+        if job.error:
+            final["error"] = job.error
+        yield json.dumps(final) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/cache")
+async def cache_stats(x_app_token: str | None = Header(None, alias="x-app-token")):
+    if x_app_token != APP_TOKEN:
+        return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+    return JSONResponse({
+        "ok": True,
+        "enabled": cache.enabled,
+        "size_bytes": await asyncio.to_thread(lambda: cache.size) if cache.enabled else 0,
+        "max_bytes": cache.max_bytes,
+        **cache.stats,
+    })
@@ -0,0 +1,130 @@
+"""
+Load benchmark for the OCR API.
+
+Generates synthetic "scanned" PDFs (noisy, slightly rotated page images of
+random words, no text layer) and fires them at POST /ocr at each requested
+concurrency and page count, then reports latency percentiles, throughput and
+how many requests were shed with 503.
+
+Every request gets a freshly generated document so the result cache never
+answers; pass --cached to reuse one document and measure the cache path
+instead. Needs the extras in requirements-dev.txt (httpx, Pillow >= 10.1).
+
+    uvicorn app:app --port 8000
+    python bench.py --concurrency 1 2 4 8 --pages 1 5 --requests 16
+"""
+import argparse, asyncio, io, json, random, statistics, string, time
+import httpx
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+def make_pdf(pages: int, rng: random.Random, dpi: int = 150) -> bytes:
+    """A scan-like PDF: each page is one grayscale image of random words."""
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    try:
+        font = ImageFont.load_default(size=dpi // 6)
+    except TypeError:
+        # Pillow < 10.1 has no sized default font; the bitmap one is tiny but still text
+        font = ImageFont.load_default()
+    images = []
+    for _ in range(pages):
+        page = Image.new("L", (width, height), 255)
+        draw = ImageDraw.Draw(page)
+        for y in range(dpi, height - dpi, dpi // 4):
+            words = (
+                "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9)))
+                for _ in range(rng.randint(6, 12))
+            )
+            draw.text((dpi, y), " ".join(words), fill=rng.randint(0, 60), font=font)
+        # Scanner artefacts: slight skew, blur and speckle.
+        page = page.rotate(rng.uniform(-1.5, 1.5), fillcolor=255).filter(ImageFilter.GaussianBlur(0.6))
+        speckle = page.load()
+        for _ in range(width * height // 400):
+            speckle[rng.randrange(width), rng.randrange(height)] = rng.randint(0, 255)
+        images.append(page)
+    buf = io.BytesIO()
+    images[0].save(buf, "PDF", resolution=dpi, save_all=True, append_images=images[1:])
+    return buf.getvalue()
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+async def run_level(client: httpx.AsyncClient, args, concurrency: int, pages: int, rng: random.Random) -> dict:
+    # Documents are built up front so generation time doesn't count as latency.
+    shared = make_pdf(pages, rng) if args.cached else None
+    docs = [shared or make_pdf(pages, rng) for _ in range(args.requests)]
+    pending = iter(enumerate(docs))
+    latencies, statuses, stages = [], {}, {}
+
+    async def worker():
+        for i, pdf in pending:
+            start = time.perf_counter()
+            r = await client.post(
+                f"{args.url}/ocr",
+                params={"lang": args.lang, "mode": args.mode, "output": args.output},
+                headers={"x-app-token": args.token},
+                files={"file": (f"bench_{i}.pdf", pdf, "application/pdf")},
+            )
+            elapsed = time.perf_counter() - start
+            statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+            if r.status_code == 200:
+                latencies.append(elapsed)
+                if args.output == "text":
+                    for stage, ms in r.json().get("timings_ms", {}).items():
+                        stages.setdefault(stage, []).append(ms)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    ok = len(latencies)
+    return {
+        "concurrency": concurrency,
+        "pages": pages,
+        "requests": args.requests,
+        "ok": ok,
+        "shed_503": statuses.get(503, 0),
+        "errors": sum(n for code, n in statuses.items() if code not in (200, 503)),
+        "wall_s": round(wall, 3),
+        "docs_per_s": round(ok / wall, 3),
+        "pages_per_s": round(ok * pages / wall, 3),
+        "p50_s": round(percentile(latencies, 50), 3),
+        "p95_s": round(percentile(latencies, 95), 3),
+        "mean_s": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        "stage_p50_ms": {stage: round(percentile(ms, 50), 1) for stage, ms in stages.items()},
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--token", default="changeme")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 5])
+    parser.add_argument("--requests", type=int, default=8, help="requests per (concurrency, pages) level")
+    parser.add_argument("--lang", default="eng")
+    parser.add_argument("--mode", default="force", choices=["auto", "force", "skip_text"])
+    parser.add_argument("--output", default="text", choices=["text", "pdf", "both"])
+    parser.add_argument("--cached", action="store_true", help="reuse one document per level (exercises the cache)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per level instead of a table")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    async with httpx.AsyncClient(timeout=None) as client:
+        if not args.json:
+            print(f"{'conc':>4} {'pages':>5} {'ok':>4} {'503':>4} {'err':>4} {'p50 s':>8} {'p95 s':>8} {'docs/s':>8} {'pages/s':>8}  stage p50 ms")
+        for pages in args.pages:
+            for concurrency in args.concurrency:
+                result = await run_level(client, args, concurrency, pages, rng)
+                if args.json:
+                    print(json.dumps(result))
+                    continue
+                stage_ms = " ".join(f"{k}={v}" for k, v in result["stage_p50_ms"].items())
+                print(
+                    f"{concurrency:>4} {pages:>5} {result['ok']:>4} {result['shed_503']:>4} {result['errors']:>4} "
+                    f"{result['p50_s']:>8} {result['p95_s']:>8} {result['docs_per_s']:>8} {result['pages_per_s']:>8}  {stage_ms}"
+                )
+
+if __name__ == "__main__":
+    asyncio.run(main())
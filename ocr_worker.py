@@ -0,0 +1,38 @@
+"""
+Entry points for the warm OCR worker processes used when OCR_ENGINE=worker.
+
+Kept out of app.py so that spawned workers import ocrmypdf once and nothing
+of the web app.
+"""
+import os, resource
+
+def init(omp_thread_limit: str, max_memory_mb: int):
+    """
+    Process initializer: apply the same limits a CLI run would get, then pay
+    for importing ocrmypdf and its plugin modules once per worker lifetime.
+    """
+    os.environ["OMP_THREAD_LIMIT"] = omp_thread_limit
+    if max_memory_mb > 0:
+        limit = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    import ocrmypdf
+    from ocrmypdf._plugin_manager import get_plugin_manager
+    ocrmypdf.configure_logging(ocrmypdf.Verbosity.quiet)
+    # Each ocr() call builds its own plugin manager (ocrmypdf 16 rejects a
+    # shared one), but the plugin modules stay imported after this.
+    get_plugin_manager([])
+
+def ping() -> int:
+    """No-op task used to spawn and warm workers ahead of the first request."""
+    return os.getpid()
+
+def ocr(input_file: str, output_file: str, options: dict):
+    import ocrmypdf
+    try:
+        code = ocrmypdf.ocr(input_file, output_file, progress_bar=False, use_threads=True, **options)
+    except Exception as e:
+        # ocrmypdf's exceptions don't all survive pickling back to the parent
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+    if code != ocrmypdf.ExitCode.ok:
+        raise RuntimeError(f"ocrmypdf exited with {code!r}")
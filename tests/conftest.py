@@ -0,0 +1,19 @@
+import pytest
+from fastapi.testclient import TestClient
+import app
+
+@pytest.fixture
+def isolated(tmp_path, monkeypatch):
+    """Give the app its own cache, job directory and core pool."""
+    monkeypatch.setattr(app, "cache", app.ResultCache(str(tmp_path / "cache"), 1 << 20, 3600))
+    monkeypatch.setattr(app, "OCR_JOB_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(app, "pool", app.JobPool(2, 2))
+
+def make_client():
+    return TestClient(app.app, headers={"x-app-token": app.APP_TOKEN})
+
+@pytest.fixture
+def client(isolated):
+    """A client for the isolated app, lifespan included."""
+    with make_client() as client:
+        yield client
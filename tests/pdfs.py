@@ -0,0 +1,38 @@
+"""Small PDFs built with pikepdf, for tests that need real documents."""
+import pikepdf
+from app import native_text
+
+def text_page(pdf: pikepdf.Pdf, text: str):
+    font = pdf.make_indirect(pikepdf.Dictionary(Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1,
+                                                BaseFont=pikepdf.Name.Helvetica))
+    content = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+    pdf.add_blank_page(page_size=(612, 792))
+    page = pdf.pages[-1]
+    page.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font))
+    page.Contents = pdf.make_stream(content)
+
+def scan_page(pdf: pikepdf.Pdf, junk: str = ""):
+    """A page covered by one image, optionally with a (junk) text layer on top."""
+    image = pdf.make_stream(b"\x80" * 64, Type=pikepdf.Name.XObject, Subtype=pikepdf.Name.Image,
+                            Width=8, Height=8, ColorSpace=pikepdf.Name.DeviceGray, BitsPerComponent=8)
+    text_page(pdf, junk)
+    page = pdf.pages[-1]
+    page.Resources.XObject = pikepdf.Dictionary(Im0=image)
+    page.Contents = pdf.make_stream(b"q 612 0 0 792 0 0 cm /Im0 Do Q " + page.Contents.read_bytes())
+
+def make_pdf(path, *pages):
+    """Write a PDF with one page per item: a string is a text page, None a blank scan."""
+    with pikepdf.new() as pdf:
+        for page in pages:
+            if page is None:
+                scan_page(pdf)
+            else:
+                text_page(pdf, page)
+        pdf.save(path)
+    return str(path)
+
+def page_texts(path) -> list[str]:
+    with pikepdf.open(path) as pdf:
+        n = len(pdf.pages)
+    found = native_text(path, list(range(1, n + 1)), "skip_text")
+    return [found.get(i, "").strip() for i in range(1, n + 1)]
@@ -0,0 +1,54 @@
+import asyncio, os
+import app
+from app import ResultCache, assemble_pdf, extract_pages
+from pdfs import make_pdf, page_texts
+
+def test_assemble_pdf_merges_chunks_in_page_order(tmp_path):
+    src = make_pdf(tmp_path / "src.pdf", "orig 1", "orig 2", "orig 3", "orig 4", "orig 5")
+    # Chunks finish out of order; page 2 was native text and comes from the original
+    chunks = [
+        ([4, 5], make_pdf(tmp_path / "c45.pdf", "ocr 4", "ocr 5")),
+        ([1], make_pdf(tmp_path / "c1.pdf", "ocr 1")),
+        ([3], make_pdf(tmp_path / "c3.pdf", "ocr 3")),
+    ]
+    dest = str(tmp_path / "out.pdf")
+    assemble_pdf(src, [1, 2, 3, 4, 5], chunks, dest)
+    assert page_texts(dest) == ["ocr 1", "orig 2", "ocr 3", "ocr 4", "ocr 5"]
+
+def test_assemble_pdf_subset_of_pages(tmp_path):
+    src = make_pdf(tmp_path / "src.pdf", "orig 1", "orig 2", "orig 3")
+    dest = str(tmp_path / "out.pdf")
+    assemble_pdf(src, [1, 3], [([3], make_pdf(tmp_path / "c3.pdf", "ocr 3"))], dest)
+    assert page_texts(dest) == ["orig 1", "ocr 3"]
+
+def test_assemble_pdf_single_chunk_is_copied_as_is(tmp_path):
+    src = make_pdf(tmp_path / "src.pdf", "orig 1", "orig 2")
+    chunk = make_pdf(tmp_path / "all.pdf", "ocr 1", "ocr 2")
+    dest = tmp_path / "out.pdf"
+    assemble_pdf(src, [1, 2], [([1, 2], chunk)], str(dest))
+    assert dest.read_bytes() == (tmp_path / "all.pdf").read_bytes()
+
+def test_only_a_single_covering_run_is_built_as_pdfa(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "cache", ResultCache(str(tmp_path / "cache"), 0, 3600))
+    types = []
+
+    async def fake_chunk(in_pdf, pages, total, work, params, pdf_type=None, jobs=1):
+        types.append(pdf_type)
+        out = os.path.join(work, f"out_{pages[0]}.pdf")
+        extract_pages(in_pdf, pages, out)
+        return [f"ocr {n}" for n in pages], out
+
+    monkeypatch.setattr(app, "ocr_chunk", fake_chunk)
+    scans = make_pdf(tmp_path / "scans.pdf", None, None)
+    mixed = make_pdf(tmp_path / "mixed.pdf", None, "A born digital page with plenty of text")
+
+    def ocr(doc, chunk_pages):
+        out = str(tmp_path / "out.pdf")
+        asyncio.run(app.ocr_document(doc, str(tmp_path), [1, 2], 2, app.OcrParams(), chunk_pages, out_pdf=out))
+        return len(page_texts(out))
+
+    assert ocr(scans, 2) == 2 and types == [app.OCR_PDF_OUTPUT_TYPE]
+    types.clear()
+    assert ocr(scans, 1) == 2 and types == ["pdf", "pdf"]
+    types.clear()
+    assert ocr(mixed, 2) == 2 and types == ["pdf"]
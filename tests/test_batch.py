@@ -0,0 +1,59 @@
+import io, json, zipfile
+import app
+from pdfs import make_pdf
+
+TEXT = "A born digital page with plenty of text"
+
+def pdf_bytes(tmp_path, name, padding=0):
+    """A born-digital PDF; `padding` bytes of trailing zeros make it big but compressible."""
+    with open(make_pdf(tmp_path / name, TEXT), "rb") as f:
+        return f.read() + b"\0" * padding
+
+def zip_bytes(members: dict) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+def post_batch(client, *files):
+    r = client.post("/ocr/batch?mode=auto", files=[("files", f) for f in files])
+    lines = [json.loads(line) for line in r.text.splitlines()] if r.status_code == 200 else None
+    return r, lines
+
+def test_zip_with_too_many_documents_is_rejected(tmp_path, client, monkeypatch):
+    monkeypatch.setattr(app, "OCR_MAX_BATCH_FILES", 2)
+    archive = zip_bytes({f"{i}.pdf": pdf_bytes(tmp_path, f"{i}.pdf") for i in range(3)})
+    r, _ = post_batch(client, ("docs.zip", archive, "application/zip"))
+    assert r.status_code == 413
+    assert "more than 2 documents" in r.json()["error"]
+
+def test_zip_over_the_uncompressed_budget_is_rejected(tmp_path, client, monkeypatch):
+    monkeypatch.setattr(app, "OCR_MAX_BATCH_MB", 1)
+    archive = zip_bytes({"a.pdf": pdf_bytes(tmp_path, "a.pdf", 600_000),
+                         "b.pdf": pdf_bytes(tmp_path, "b.pdf", 600_000)})
+    assert len(archive) < 100_000  # the archive itself is well within the limit
+    r, _ = post_batch(client, ("docs.zip", archive, "application/zip"))
+    assert r.status_code == 413
+    assert "uncompressed" in r.json()["error"]
+
+def test_oversized_member_fails_alone(tmp_path, client, monkeypatch):
+    monkeypatch.setattr(app, "OCR_MAX_UPLOAD_MB", 1)
+    archive = zip_bytes({"big.pdf": pdf_bytes(tmp_path, "big.pdf", 2_000_000),
+                         "small.pdf": pdf_bytes(tmp_path, "small.pdf")})
+    r, lines = post_batch(client, ("docs.zip", archive, "application/zip"))
+    assert r.status_code == 200
+    results = {line["filename"]: line for line in lines[:-1]}
+    assert results["docs.zip/big.pdf"]["error"] == "upload exceeds 1 MB"
+    assert results["docs.zip/small.pdf"]["ok"] and TEXT in results["docs.zip/small.pdf"]["text"]
+    assert lines[-1] == {"done": True, "files": 2, "failed": 1}
+
+def test_corrupt_zip_becomes_an_error_line(tmp_path, client):
+    r, lines = post_batch(client, ("broken.zip", b"PK\x03\x04 not really a zip", "application/zip"),
+                          ("digital.pdf", pdf_bytes(tmp_path, "digital.pdf"), "application/pdf"))
+    assert r.status_code == 200
+    results = {line["filename"]: line for line in lines[:-1]}
+    assert not results["broken.zip"]["ok"]
+    assert results["broken.zip"]["error"] == "upload is not a readable zip"
+    assert results["digital.pdf"]["ok"]
+    assert lines[-1] == {"done": True, "files": 2, "failed": 1}
@@ -0,0 +1,103 @@
+import json, os, time
+from app import ResultCache, page_digests
+from pdfs import make_pdf
+
+def disk_size(root):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+
+def age(cache, key, seconds):
+    """Pretend `key` was last used `seconds` ago."""
+    for ext in (".json", ".pdf"):
+        path = cache._path(key, ext)
+        if os.path.exists(path):
+            t = time.time() - seconds
+            os.utime(path, (t, t))
+
+def test_roundtrip_and_stats(tmp_path):
+    cache = ResultCache(str(tmp_path), 1 << 20, 3600)
+    key = cache.key("digest", [1, 2], "eng")
+    assert cache.get(key) is None
+    cache.put(key, {"pages": ["a", "b"]})
+    assert cache.get(key)["pages"] == ["a", "b"]
+    assert cache.get(key, page=True)["pages"] == ["a", "b"]
+    assert (cache.stats["hits"], cache.stats["misses"], cache.stats["page_hits"]) == (1, 1, 1)
+
+def test_key_depends_on_every_part():
+    assert ResultCache.key("d", [1], "eng") != ResultCache.key("d", [1], "deu")
+    assert ResultCache.key("d", [1], "eng") == ResultCache.key("d", [1], "eng")
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = ResultCache(str(tmp_path), 0, 3600)
+    cache.put("k", {"pages": []})
+    assert cache.get("k") is None
+    assert os.listdir(tmp_path) == []
+
+def test_expired_entries_are_misses_and_removed(tmp_path):
+    cache = ResultCache(str(tmp_path), 1 << 20, 60)
+    cache.put("old", {"pages": ["x"]})
+    path = cache._path("old", ".json")
+    # Backdate the entry instead of sleeping past the TTL
+    with open(path, "w") as f:
+        json.dump({"pages": ["x"], "created": time.time() - 120}, f)
+    assert cache.get("old") is None
+    assert not os.path.exists(path)
+
+def test_size_tracks_disk(tmp_path):
+    src = tmp_path / "out.pdf"
+    src.write_bytes(b"%PDF-" + b"x" * 500)
+    root = tmp_path / "cache"
+    cache = ResultCache(str(root), 1 << 20, 3600)
+    cache.put("a", {"pages": ["a"]}, pdf_path=str(src))
+    cache.put("b", {"pages": ["b"]})
+    cache.put("a", {"pages": ["a2"]})  # replacing drops the old PDF
+    assert cache.size == disk_size(root)
+    # A fresh instance computes the same size from disk
+    assert ResultCache(str(root), 1 << 20, 3600).size == cache.size
+
+def test_eviction_drops_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), 3000, 3600)
+    for i, key in enumerate(["k0", "k1", "k2"]):
+        cache.put(key, {"pages": ["x" * 800]})
+        age(cache, key, 100 - i)
+    cache.get("k0")  # k0 is now the most recently used
+    cache.put("k3", {"pages": ["x" * 800]})
+    assert cache.get("k1") is None
+    assert cache.get("k0") and cache.get("k2") and cache.get("k3")
+    assert cache.size <= 3000 * 0.9
+
+def test_hot_pdf_entry_survives_eviction_whole(tmp_path):
+    src = tmp_path / "out.pdf"
+    src.write_bytes(b"%PDF-" + b"x" * 4000)
+    cache = ResultCache(str(tmp_path / "cache"), 10_000, 3600)
+    cache.put("hot", {"pages": ["a"]}, pdf_path=str(src))
+    age(cache, "hot", 100)
+    for i, key in enumerate(["c1", "c2", "c3"]):
+        cache.put(key, {"pages": ["b" * 800]})
+        age(cache, key, 50 - i)
+    for _ in range(3):
+        assert cache.get("hot")
+        assert cache.copy_pdf("hot", str(tmp_path / "copy.pdf"))
+    cache.put("new", {"pages": ["n" * 4000]})
+    assert cache.copy_pdf("hot", str(tmp_path / "copy.pdf"))
+    assert cache.get("c1") is None
+    # JSON and PDF are evicted together, never one half of an entry
+    for key in ["hot", "c1", "c2", "c3", "new"]:
+        assert os.path.exists(cache._path(key, ".pdf")) <= os.path.exists(cache._path(key, ".json"))
+
+def test_orphaned_pdf_is_evicted_first(tmp_path):
+    cache = ResultCache(str(tmp_path), 3000, 3600)
+    orphan = cache._path("orphan", ".pdf")
+    os.makedirs(os.path.dirname(orphan))
+    with open(orphan, "wb") as f:
+        f.write(b"x" * 100)
+    cache.put("a", {"pages": ["x" * 800]})
+    cache._evict()
+    assert not os.path.exists(orphan)
+    assert cache.get("a")
+
+def test_page_digests_identify_content_not_document(tmp_path):
+    a = make_pdf(tmp_path / "a.pdf", "same", "other")
+    b = make_pdf(tmp_path / "b.pdf", "unrelated", "same")
+    da, db = page_digests(a, [1, 2]), page_digests(b, [1, 2])
+    assert da[1] == db[2]
+    assert da[2] != db[1]
@@ -0,0 +1,44 @@
+import os, time
+import app
+from conftest import make_client
+from pdfs import make_pdf
+
+def wait_done(client, job_id):
+    for _ in range(100):
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "error"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError("job did not finish")
+
+def test_job_pdfs_live_in_the_job_dir_and_are_removed_on_shutdown(tmp_path, isolated):
+    doc = make_pdf(tmp_path / "digital.pdf", "A born digital page with plenty of text")
+    with make_client() as client:
+        with open(doc, "rb") as f:
+            r = client.post("/jobs?output=pdf", files={"file": ("digital.pdf", f, "application/pdf")})
+        assert r.status_code == 202
+        job = wait_done(client, r.json()["id"])
+        assert job["status"] == "done"
+        pdf_path = app.jobs[job["id"]].pdf_path
+        assert pdf_path.startswith(app.OCR_JOB_DIR) and os.path.exists(pdf_path)
+        assert client.get(f"/jobs/{job['id']}/pdf").content.startswith(b"%PDF")
+    assert not os.path.exists(pdf_path)
+
+def test_finished_jobs_expire_when_polled(tmp_path, client, monkeypatch):
+    doc = make_pdf(tmp_path / "digital.pdf", "A born digital page with plenty of text")
+    with open(doc, "rb") as f:
+        job_id = client.post("/jobs?output=pdf", files={"file": ("digital.pdf", f, "application/pdf")}).json()["id"]
+    pdf_path = app.jobs[job_id].pdf_path
+    wait_done(client, job_id)
+    monkeypatch.setattr(app, "OCR_JOB_TTL", 0)
+    time.sleep(0.01)
+    assert client.get(f"/jobs/{job_id}").status_code == 404
+    assert not os.path.exists(pdf_path)
+
+def test_startup_clears_pdfs_left_by_dead_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "OCR_JOB_DIR", str(tmp_path / "jobs"))
+    stale = tmp_path / "jobs" / "999999999"
+    stale.mkdir(parents=True)
+    (stale / "old.pdf").write_bytes(b"%PDF-")
+    app.clear_job_dirs()
+    assert not stale.exists()
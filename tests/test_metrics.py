@@ -0,0 +1,31 @@
+import asyncio
+from prometheus_client import REGISTRY
+import app
+from pdfs import make_pdf
+
+def observed(route):
+    labels = {"route": route}
+    return (REGISTRY.get_sample_value("ocr_http_request_seconds_count", labels) or 0,
+            REGISTRY.get_sample_value("ocr_http_request_seconds_sum", labels) or 0)
+
+def test_streamed_response_is_timed_until_its_last_line(tmp_path, client, monkeypatch):
+    ocr_batch_doc = app.ocr_batch_doc
+
+    async def slow(*args):
+        await asyncio.sleep(0.3)
+        return await ocr_batch_doc(*args)
+    monkeypatch.setattr(app, "ocr_batch_doc", slow)
+    before = observed("/ocr/batch")
+    with open(make_pdf(tmp_path / "digital.pdf", "A born digital page with plenty of text"), "rb") as f:
+        r = client.post("/ocr/batch", files={"files": ("digital.pdf", f, "application/pdf")},
+                        headers={"x-request-id": "batch-1"})
+    assert r.status_code == 200 and r.headers["x-request-id"] == "batch-1"
+    count, seconds = observed("/ocr/batch")
+    assert count == before[0] + 1
+    assert seconds - before[1] >= 0.3
+
+def test_requests_get_an_id_and_a_route_label(client):
+    before = observed("/jobs/{job_id}")
+    r = client.get("/jobs/missing")
+    assert r.status_code == 404 and len(r.headers["x-request-id"]) == 16
+    assert observed("/jobs/{job_id}")[0] == before[0] + 1
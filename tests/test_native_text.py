@@ -0,0 +1,25 @@
+import pikepdf
+from app import native_text
+from pdfs import scan_page, text_page
+
+def test_native_text_modes(tmp_path):
+    path = str(tmp_path / "mixed.pdf")
+    with pikepdf.new() as pdf:
+        text_page(pdf, "A born digital page with plenty of text")
+        scan_page(pdf)
+        scan_page(pdf, "junk layer over a scanned image")
+        text_page(pdf, "short")
+        pdf.save(path)
+    pages = [1, 2, 3, 4]
+    auto = native_text(path, pages, "auto")
+    assert list(auto) == [1]
+    assert "born digital" in auto[1]
+    # skip_text takes any page with text, however short or whatever lies beneath
+    assert list(native_text(path, pages, "skip_text")) == [1, 3, 4]
+    assert native_text(path, pages, "force") == {}
+    assert native_text(path, [], "auto") == {}
+
+def test_native_text_gives_up_on_unreadable_pdf(tmp_path):
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"%PDF-1.4 not really")
+    assert native_text(str(path), [1], "auto") == {}
@@ -0,0 +1,32 @@
+import pytest
+from app import extract_pages, parse_pages
+from pdfs import make_pdf, page_texts
+
+@pytest.mark.parametrize("spec, expected", [
+    (None, [1, 2, 3, 4, 5]),
+    ("2", [2]),
+    ("1-2", [1, 2]),
+    ("1,3,5", [1, 3, 5]),
+    ("4-", [4, 5]),
+    ("-2", [1, 2]),
+    ("3,1-2,3", [1, 2, 3]),
+    ("4-99", [4, 5]),
+])
+def test_parse_pages(spec, expected):
+    assert parse_pages(spec, 5) == expected
+
+@pytest.mark.parametrize("spec", ["0", "3-1", "x", "9", "1-2,0"])
+def test_parse_pages_rejects_bad_specs(spec):
+    with pytest.raises(ValueError):
+        parse_pages(spec, 5)
+
+@pytest.mark.parametrize("spec", ["a-b", "1,x", "2-y"])
+def test_parse_pages_names_the_bad_part(spec):
+    with pytest.raises(ValueError, match="invalid page range"):
+        parse_pages(spec, 5)
+
+def test_extract_pages_keeps_order(tmp_path):
+    src = make_pdf(tmp_path / "src.pdf", "one", "two", "three", "four")
+    dest = str(tmp_path / "chunk.pdf")
+    extract_pages(src, [2, 4], dest)
+    assert page_texts(dest) == ["two", "four"]
@@ -0,0 +1,155 @@
+import asyncio, time
+import pytest
+import app
+from app import JobPool, PoolSaturated, ResultCache, spread
+from pdfs import make_pdf
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_lone_job_gets_all_cores_but_the_reserve():
+    async def main():
+        pool = JobPool(8, 4, reserve=1)
+        async with pool.admit(want=100) as grant:
+            assert grant.cores == 7
+            assert pool.free == 1
+        assert (pool.free, pool.pending, pool.running) == (8, 0, 0)
+    run(main())
+
+def test_grant_never_exceeds_want():
+    async def main():
+        pool = JobPool(8, 4)
+        async with pool.admit(want=2) as grant:
+            assert grant.cores == 2
+    run(main())
+
+def test_waiting_jobs_split_cores_fairly():
+    async def main():
+        pool = JobPool(8, 8)
+        grants = []
+        gate = asyncio.Event()
+
+        async def job(slot):
+            async with slot as grant:
+                grants.append(grant.cores)
+                await gate.wait()
+
+        # All four are admitted before any of them is granted cores
+        tasks = [asyncio.create_task(job(pool.admit(want=100))) for _ in range(4)]
+        await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.gather(*tasks)
+        return grants
+    assert run(main()) == [2, 2, 2, 2]
+
+def test_full_pool_rejects_immediately():
+    async def main():
+        pool = JobPool(1, 1)
+        first, second = pool.admit(), pool.admit()
+        with pytest.raises(PoolSaturated):
+            pool.admit()
+        async with first:
+            pass
+        async with second:
+            pass
+        assert pool.pending == 0
+    run(main())
+
+def test_cancelled_waiter_releases_its_place():
+    async def main():
+        pool = JobPool(1, 1)
+        async with pool.admit():
+            waiter = asyncio.create_task(pool.admit().__aenter__())
+            await asyncio.sleep(0.01)
+            assert pool.waiting == 1
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        assert (pool.free, pool.pending, pool.running) == (1, 0, 0)
+    run(main())
+
+def test_small_jobs_are_not_starved_by_a_large_chunked_job():
+    async def main():
+        pool = JobPool(8, 16, reserve=1)
+        waits = []
+
+        async def large():
+            async with pool.admit(want=200) as grant:
+                async def chunk(_):
+                    await asyncio.sleep(0.02)
+                await spread(list(range(200)), chunk, grant.cores, grant)
+                # Idle cores are taken back once the small jobs are gone
+                assert grant.cores == 7
+
+        async def small():
+            await asyncio.sleep(0.05)
+            queued = time.perf_counter()
+            async with pool.admit():
+                waits.append(time.perf_counter() - queued)
+                await asyncio.sleep(0.1)
+
+        await asyncio.gather(large(), *(small() for _ in range(4)))
+        assert pool.free == 8
+        return waits
+    # Each small job starts within about one chunk of arriving, not after the large job
+    assert max(run(main())) < 0.1
+
+def test_spread_runs_every_item_in_order():
+    async def main():
+        seen = []
+
+        async def fn(item):
+            seen.append(item)
+            await asyncio.sleep(0)
+
+        await spread(list(range(10)), fn, 3)
+        return seen
+    assert run(main()) == list(range(10))
+
+def test_spread_cancels_the_rest_when_one_fails():
+    async def main():
+        finished = []
+
+        async def fn(item):
+            if item == 0:
+                raise ValueError("boom")
+            await asyncio.sleep(0.05)
+            finished.append(item)
+
+        with pytest.raises(ValueError):
+            await spread(list(range(4)), fn, 4)
+        await asyncio.sleep(0.1)
+        return finished
+    assert run(main()) == []
+
+def test_document_without_pages_to_ocr_never_waits_for_cores(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "cache", ResultCache(str(tmp_path / "cache"), 0, 3600))
+    doc = make_pdf(tmp_path / "digital.pdf", "A born digital page with plenty of text")
+
+    async def main():
+        pool = JobPool(1, 1)
+        async with pool.admit():
+            # Every core is taken, yet a document with nothing to OCR finishes
+            slot = pool.admit()
+            texts, stats = await asyncio.wait_for(
+                app.ocr_document(doc, str(tmp_path), [1], 1, app.OcrParams(), 1, slot=slot), 1)
+            assert stats["native"] == 1 and "born digital" in texts[0]
+        assert (pool.free, pool.pending, pool.running) == (1, 0, 0)
+    run(main())
+
+def test_full_pool_sheds_new_ocr_work_with_retry_after(tmp_path, client):
+    doc = make_pdf(tmp_path / "digital.pdf", "A born digital page with plenty of text")
+    slots = []
+    while not app.pool.full:
+        slots.append(app.pool.admit())
+    for path in app.OCR_ENDPOINTS:
+        with open(doc, "rb") as f:
+            name = "files" if path == "/ocr/batch" else "file"
+            r = client.post(path, files={name: ("digital.pdf", f, "application/pdf")})
+        assert r.status_code == 503
+        assert r.headers["retry-after"] == str(app.OCR_RETRY_AFTER)
+    # Reads are never shed
+    assert client.get("/cache").status_code == 200
+    slots.pop().release()
+    with open(doc, "rb") as f:
+        assert client.post("/ocr", files={"file": ("digital.pdf", f, "application/pdf")}).status_code == 200
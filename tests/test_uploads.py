@@ -0,0 +1,62 @@
+import app
+from pdfs import make_pdf
+
+TEXT = "A born digital page with plenty of text"
+
+def big_pdf(tmp_path, size):
+    with open(make_pdf(tmp_path / "big.pdf", TEXT), "rb") as f:
+        return f.read() + b"\0" * size
+
+def post_pdf(client, data, **kwargs):
+    return client.post("/ocr", files={"file": ("doc.pdf", data, "application/pdf")}, **kwargs)
+
+def test_born_digital_upload_is_accepted(tmp_path, client):
+    with open(make_pdf(tmp_path / "doc.pdf", TEXT), "rb") as f:
+        r = post_pdf(client, f.read())
+    assert r.status_code == 200 and TEXT in r.json()["text"]
+
+def test_announced_oversized_upload_is_rejected_before_parsing(tmp_path, client, monkeypatch):
+    monkeypatch.setattr(app, "OCR_MAX_UPLOAD_MB", 1)
+
+    async def never(*args, **kwargs):
+        raise AssertionError("the body should not have been read")
+    monkeypatch.setattr(app, "save_upload", never)
+    r = post_pdf(client, big_pdf(tmp_path, 2 << 20))
+    assert r.status_code == 413
+    assert r.json()["error"] == "upload exceeds 1 MB"
+
+def test_chunked_oversized_upload_is_cut_off_while_saving(tmp_path, client, monkeypatch):
+    monkeypatch.setattr(app, "OCR_MAX_UPLOAD_MB", 1)
+    saved = []
+    save_upload = app.save_upload
+
+    async def spy(*args, **kwargs):
+        saved.append(args)
+        return await save_upload(*args, **kwargs)
+    monkeypatch.setattr(app, "save_upload", spy)
+    boundary = "testboundary"
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"doc.pdf\"\r\n"
+            "Content-Type: application/pdf\r\n\r\n").encode() \
+        + big_pdf(tmp_path, 2 << 20) + f"\r\n--{boundary}--\r\n".encode()
+    # A generator body is sent chunked, with no Content-Length for the middleware to check
+    r = client.post("/ocr", content=(body[i:i + 65536] for i in range(0, len(body), 65536)),
+                    headers={"content-type": f"multipart/form-data; boundary={boundary}"})
+    assert r.status_code == 413 and saved
+    assert r.json()["error"] == "upload exceeds 1 MB"
+
+def test_non_pdf_is_rejected(client):
+    r = post_pdf(client, b"GIF89a definitely not a pdf")
+    assert r.status_code == 400
+    assert r.json()["error"] == "upload is not a PDF"
+
+def test_empty_upload_is_rejected(client):
+    r = post_pdf(client, b"")
+    assert r.status_code == 400
+    assert r.json()["error"] == "empty upload"
+
+def test_too_many_pages_is_rejected(tmp_path, client, monkeypatch):
+    monkeypatch.setattr(app, "OCR_MAX_PAGES", 2)
+    with open(make_pdf(tmp_path / "long.pdf", TEXT, TEXT, TEXT), "rb") as f:
+        r = post_pdf(client, f.read())
+    assert r.status_code == 413
+    assert r.json()["error"] == "PDF has 3 pages, limit is 2"
@@ -0,0 +1,63 @@
+import asyncio, os, signal, time
+import pytest
+import app, ocr_worker
+from pdfs import make_pdf
+
+def fake_ocr(input_file, output_file, options):
+    """Stands in for ocrmypdf in the workers; the first run also records its pid."""
+    marker = options["sidecar"] + ".pid"
+    if not os.path.exists(os.path.dirname(marker) + "/killed"):
+        with open(marker, "w") as f:
+            f.write(str(os.getpid()))
+        time.sleep(5)
+    with open(options["sidecar"], "w") as f:
+        f.write("recognized")
+
+@pytest.fixture
+def warm(monkeypatch):
+    # Workers are forked after this, so they run fake_ocr instead of ocrmypdf
+    monkeypatch.setattr(ocr_worker, "ocr", fake_ocr)
+    monkeypatch.setattr(app, "OCR_CORES", 2)
+    monkeypatch.setattr(app, "workers", None)
+
+def test_killed_worker_is_replaced_and_its_run_retried(tmp_path, warm):
+    doc = make_pdf(tmp_path / "scan.pdf", None)
+    marker = tmp_path / "text_1-1.txt.pid"
+
+    async def main():
+        await app.start_workers()
+        first = app.workers
+        try:
+            run = asyncio.create_task(app.ocr_chunk(doc, [1], 1, str(tmp_path), app.OcrParams()))
+            while not marker.exists() or not marker.read_text():
+                await asyncio.sleep(0.01)
+            (tmp_path / "killed").touch()
+            os.kill(int(marker.read_text()), signal.SIGKILL)
+            texts, _ = await asyncio.wait_for(run, 10)
+            assert texts == ["recognized"]
+            assert app.workers is not first
+            # The new pool keeps serving
+            texts, _ = await app.ocr_chunk(doc, [1], 1, str(tmp_path), app.OcrParams())
+            assert texts == ["recognized"]
+        finally:
+            await asyncio.to_thread(app.workers.shutdown, cancel_futures=True)
+    asyncio.run(main())
+
+def test_broken_pool_is_restarted_by_the_next_run(tmp_path, warm):
+    doc = make_pdf(tmp_path / "scan.pdf", None)
+    (tmp_path / "killed").touch()
+
+    async def main():
+        await app.start_workers()
+        first = app.workers
+        try:
+            pid = await asyncio.get_running_loop().run_in_executor(first, ocr_worker.ping)
+            os.kill(pid, signal.SIGKILL)
+            while not first._broken:
+                await asyncio.sleep(0.01)
+            texts, _ = await app.ocr_chunk(doc, [1], 1, str(tmp_path), app.OcrParams())
+            assert texts == ["recognized"]
+            assert app.workers is not first
+        finally:
+            await asyncio.to_thread(app.workers.shutdown, cancel_futures=True)
+    asyncio.run(main())